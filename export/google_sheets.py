@@ -1,81 +1,206 @@
 import time
+import random
+import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
 import gspread
-import pytz
-from oauth2client.service_account import ServiceAccountCredentials
+from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import AuthorizedSession
 from gspread.exceptions import APIError
+from gspread.utils import absolute_range_name, rowcol_to_a1
 from googleapiclient.discovery import build
 from datetime import datetime
+from zoneinfo import ZoneInfo
 
-def upload_df_to_gsheet(df, spreadsheet_name, creds_path, retries=3, delay=10):
-    # Define Google Sheets API scope
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+# Sheets + Drive scopes cover every helper in this module
+SCOPES = (
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+)
+
+# Drive v3 files endpoint (metadata lookups go through the shared session)
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files/"
+
+# Local cache for load_gsheet_to_df results
+CACHE_DIR = "~/.cache/oareport_gspread"
+
+# Cells sent per values.batchUpdate request (keeps payloads under the API size limit)
+CELLS_PER_REQUEST = 500_000
+
+# Transient statuses worth retrying: rate limit and 5xx backend errors
+RETRYABLE_STATUS = {429, 500, 503}
+
+def _is_retryable(e):
+    return getattr(e.response, "status_code", None) in RETRYABLE_STATUS
+
+def _backoff(attempt, delay, cap=60):
+    """Full-jitter exponential backoff: uniform(0, min(cap, delay * 2**attempt))."""
+    return random.uniform(0, min(cap, delay * (2 ** attempt)))
+
+def _df_to_values(df):
+    """
+    Header + rows as a JSON-safe 2D list, converted column by column.
+    Numeric columns keep their native values (NaN -> ""); everything else becomes str.
+    """
+    cols = []
+    for c in df.columns:
+        s = df[c]
+        if is_numeric_dtype(s) and not is_bool_dtype(s):
+            cols.append(s.astype(object).where(s.notna(), "").tolist())
+        else:
+            cols.append(s.astype("string").fillna("").tolist())
+    return [[str(c) for c in df.columns]] + [list(row) for row in zip(*cols)]
+
+def _write_values(sh, ws, values, cells_per_request=CELLS_PER_REQUEST):
+    """
+    Write a 2D list to ws starting at A1 via spreadsheets.values.batchUpdate (RAW).
+    The grid is resized up front; rows are split into ~cells_per_request chunks.
+    """
+    n_rows, n_cols = len(values), max(len(values[0]), 1)
+    ws.resize(rows=max(n_rows, 1), cols=n_cols)
+
+    step = max(1, cells_per_request // n_cols)
+    for start in range(0, n_rows, step):
+        chunk = values[start:start + step]
+        first, last = start + 1, start + len(chunk)
+        sh.values_batch_update({
+            "valueInputOption": "RAW",
+            "data": [{
+                "range": absolute_range_name(ws.title, f"A{first}:{rowcol_to_a1(last, n_cols)}"),
+                "values": chunk,
+            }],
+        })
+
+@functools.lru_cache(maxsize=4)
+def _sa_creds(creds_path, scopes=SCOPES):
+    return Credentials.from_service_account_file(creds_path, scopes=list(scopes))
+
+@functools.lru_cache(maxsize=4)
+def _authorized_session(creds_path):
+    # One pooled, keep-alive HTTP session per credentials file
+    return AuthorizedSession(_sa_creds(creds_path))
 
-    # Authorise client with service account credentials
-    creds = ServiceAccountCredentials.from_json_keyfile_name(creds_path, scope)
-    client = gspread.authorize(creds)
+@functools.lru_cache(maxsize=4)
+def _drive_service(creds_path):
+    return build("drive", "v3", credentials=_sa_creds(creds_path), cache_discovery=False)
 
-    # Open the spreadsheet and get the first worksheet
-    spreadsheet = client.open(spreadsheet_name)
+@functools.lru_cache(maxsize=4)
+def _gspread_client(creds_path):
+    # google-auth refreshes the token on expiry, so the cached client stays valid
+    creds = _sa_creds(creds_path)
+    return gspread.Client(auth=creds, session=_authorized_session(creds_path))
+
+@functools.lru_cache(maxsize=16)
+def _open_spreadsheet(creds_path, spreadsheet_name):
+    # client.open() is a Drive lookup by name; do it once per process
+    return _gspread_client(creds_path).open(spreadsheet_name)
+
+def upload_df_to_gsheet(df, spreadsheet_name, creds_path, retries=3, delay=10):
+    # Open the spreadsheet (shared, cached client) and get the first worksheet
+    spreadsheet = _open_spreadsheet(creds_path, spreadsheet_name)
     worksheet = spreadsheet.get_worksheet(0)
 
-    # Get all existing rows (check if header exists)
-    existing_values = worksheet.get_all_values()
+    # Read only the header row (enough to tell if the sheet is empty)
+    first_row = worksheet.row_values(1)
+
+    # Convert dataframe to a JSON-safe 2D list (header first), column by column
+    values = _df_to_values(df)
+    data_rows = values[1:]
 
-    # If sheet is empty, write headers first
-    if not existing_values:
-        worksheet.append_row(df.columns.tolist())
+    # If sheet is empty, send headers in the same request as the data
+    if not first_row:
+        rows = values
 
     # If sheet is not empty but headers don't match, raise a warning
-    elif existing_values[0] != df.columns.tolist():
+    elif first_row != values[0]:
         print("Column headers do not match existing sheet. No data appended.")
         print("Local DF columns:", df.columns.tolist())
-        print("Remote sheet columns:", existing_values[0])
+        print("Remote sheet columns:", first_row)
         return
 
-    # Convert dataframe to list of lists
-    data_rows = df.values.tolist()
+    else:
+        rows = data_rows
 
-    # Retry appending if rate limit is hit
+    # Retry appending if rate limit is hit (all rows go in a single request)
     for attempt in range(retries):
         try:
-            worksheet.append_rows(data_rows)
+            worksheet.append_rows(rows, value_input_option="RAW", insert_data_option="INSERT_ROWS")
             print(f"Appended {len(data_rows)} rows to Google Sheet: {spreadsheet_name}")
             break  # Success, exit loop
         except APIError as e:
-            if "Quota exceeded" in str(e):
-                print(f"Rate limit hit, retrying in {delay} seconds… (attempt {attempt+1}/{retries})")
-                time.sleep(delay)
-            else:
+            if not _is_retryable(e):
                 raise  # Raise other API errors immediately
+            last_error = e
+            if attempt + 1 == retries:
+                continue  # no point sleeping before giving up
+            wait = _backoff(attempt, delay)
+            print(f"Rate limit hit, retrying in {wait:.1f} seconds… (attempt {attempt+1}/{retries})")
+            time.sleep(wait)
     else:
-        print("Failed to append rows after multiple attempts due to API rate limits.")
+        # Surface the failure so the caller (and CI's retry loop) sees a non-zero exit
+        print("Failed to append rows after multiple attempts due to API errors.")
+        raise last_error
+
+def _modified_time(creds_path, file_id):
+    """Drive modifiedTime for a file (a ~1KB metadata request)."""
+    resp = _authorized_session(creds_path).get(
+        DRIVE_FILES_URL + file_id,
+        params={"fields": "modifiedTime", "supportsAllDrives": "true"},
+    )
+    resp.raise_for_status()
+    return resp.json()["modifiedTime"]
 
-def load_gsheet_to_df(spreadsheet_name, creds_path, worksheet_index=0):
+def load_gsheet_to_df(spreadsheet_name, creds_path, worksheet_index=0, cache_dir=CACHE_DIR):
     """
     Load data from a Google Sheet into a pandas DataFrame.
     Only pulls the worksheet at the given index (default = 0).
     Assumes headers are in the first row.
+
+    Results are cached in cache_dir as {sha1(id:index)}_{sha1(modifiedTime)}.pkl, so an
+    unchanged sheet is read from local disk; older copies of the same worksheet are
+    removed when a new one is written. Pass cache_dir=None to always fetch.
     """
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(creds_path, scope)
-    client = gspread.authorize(creds)
+    spreadsheet = _open_spreadsheet(creds_path, spreadsheet_name)
 
-    spreadsheet = client.open(spreadsheet_name)
-    worksheet = spreadsheet.get_worksheet(worksheet_index)
+    cache_path = None
+    if cache_dir:
+        stamp = _modified_time(creds_path, spreadsheet.id)
+        sheet_key = hashlib.sha1(f"{spreadsheet.id}:{worksheet_index}".encode()).hexdigest()
+        cache_path = Path(cache_dir).expanduser() / f"{sheet_key}_{hashlib.sha1(stamp.encode()).hexdigest()}.pkl"
+        if cache_path.exists():
+            return pd.read_pickle(cache_path)
 
-    # Get all rows as dictionaries (header taken from row 1)
-    records = worksheet.get_all_records()
-    return pd.DataFrame(records)
+    worksheet = spreadsheet.get_worksheet(worksheet_index)
 
-def _sa_creds(creds_path, scopes):
-    return ServiceAccountCredentials.from_json_keyfile_name(creds_path, scopes)
+    # Formatted 2D values (header in row 1), as get_all_records reads them, without
+    # building a dict per row. Unformatted values would turn "45%" into 0.45 and
+    # dates into serial numbers.
+    values = worksheet.get_values()
+    df = pd.DataFrame(values[1:], columns=values[0]) if values else pd.DataFrame()
 
-def _drive_service(creds):
-    return build("drive", "v3", credentials=creds, cache_discovery=False)
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        for stale in cache_path.parent.glob(f"{sheet_key}_*.pkl"):
+            stale.unlink(missing_ok=True)
+        df.to_pickle(cache_path)
+    return df
 
-def _gspread_client(creds):
-    return gspread.authorize(creds)
+def load_multi_gsheet_to_df(sheet_map, creds_path, worksheet_index=0, cache_dir=CACHE_DIR):
+    """
+    Load several spreadsheets at once: {key: spreadsheet_name} => {key: DataFrame}.
+    Each section lives in its own spreadsheet, so a single values.batchGet can't
+    cover them; the reads run concurrently instead (wall time ~ slowest sheet).
+    """
+    _gspread_client(creds_path)  # build the shared client once, before the threads
+    with ThreadPoolExecutor(max_workers=max(1, len(sheet_map))) as ex:
+        futures = {
+            key: ex.submit(load_gsheet_to_df, name, creds_path, worksheet_index, cache_dir)
+            for key, name in sheet_map.items()
+        }
+        return {key: f.result() for key, f in futures.items()}
 
 def upload_df_to_daily_gsheet_named(
     df: pd.DataFrame,
@@ -96,50 +221,72 @@ def upload_df_to_daily_gsheet_named(
 
     Requirements:
       - Service account has Editor access to the folder (folder_id).
-      - googleapiclient is installed (pip install google-api-python-client pytz).
+      - googleapiclient is installed (pip install google-api-python-client).
     """
     env_tag = env_tag.strip().lower()
     section = section.strip().lower()
 
-    scopes = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive",
-    ]
-    creds = _sa_creds(creds_path, scopes)
-    drive = _drive_service(creds)
-    gc = _gspread_client(creds)
+    drive = _drive_service(creds_path)
+    gc = _gspread_client(creds_path)
 
     if date_str is None:
-        now = datetime.now(pytz.timezone(tz))
+        now = datetime.now(ZoneInfo(tz))
         date_str = now.date().isoformat()
 
     title = f"{env_tag}_{section}_parsed_data__{date_str}"
 
     # Delete any existing same-name spreadsheet in the folder (overwrite behaviour)
     # NOTE: name matching is exact; if you use single quotes in names you'll need escaping.
+    # The lookup always runs: each CI run starts on a fresh runner, so a local
+    # "already created today" marker could not see files from an earlier run.
     q = (
         f"name = '{title}' and "
         f"mimeType = 'application/vnd.google-apps.spreadsheet' and "
         f"'{folder_id}' in parents and trashed = false"
     )
-    resp = drive.files().list(q=q, fields="files(id,name)").execute()
-    for f in resp.get("files", []):
-        drive.files().delete(fileId=f["id"]).execute()
+    resp = drive.files().list(
+        q=q,
+        fields="files(id)",
+        supportsAllDrives=True,
+        includeItemsFromAllDrives=True,
+    ).execute()
+    stale = resp.get("files", [])
+    if stale:
+        # Send every delete in one batched HTTP request
+        errors = []
+
+        def _on_delete(request_id, response, exception):
+            if exception is not None:
+                errors.append(exception)
+
+        batch = drive.new_batch_http_request(callback=_on_delete)
+        for f in stale:
+            batch.add(drive.files().delete(fileId=f["id"], supportsAllDrives=True))
+        batch.execute()
+        if errors:
+            raise errors[0]
 
     # Create new spreadsheet in the folder
     sh = gc.create(title, folder_id=folder_id)
     ws = sh.sheet1
 
-    # Write all data in one call
-    values = [df.columns.tolist()] + df.astype(str).values.tolist()
+    # Write all data (one batchUpdate per chunk; a single call for typical frames)
+    values = _df_to_values(df)
     for attempt in range(retries):
         try:
-            ws.update("A1", values)
+            _write_values(sh, ws, values)
             print(f"Created daily sheet '{title}' in folder {folder_id} with {len(df)} rows.")
             break
         except APIError as e:
-            if "Quota exceeded" in str(e):
-                print(f"Rate limit hit, retrying in {delay}s… (attempt {attempt+1}/{retries})")
-                time.sleep(delay)
-            else:
-                raise
\ No newline at end of file
+            if not _is_retryable(e):
+                raise
+            last_error = e
+            if attempt + 1 == retries:
+                continue  # no point sleeping before giving up
+            wait = _backoff(attempt, delay)
+            print(f"Rate limit hit, retrying in {wait:.1f}s… (attempt {attempt+1}/{retries})")
+            time.sleep(wait)
+    else:
+        # The day's sheet now exists but is empty: fail loudly so the run is retried
+        print(f"Failed to write daily sheet '{title}' after {retries} attempts.")
+        raise last_error
\ No newline at end of file
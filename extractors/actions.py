@@ -3,153 +3,161 @@
 
 import sys
 import os
-import yaml
 import argparse
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import ElementClickInterceptedException
+from selenium.common.exceptions import JavascriptException, TimeoutException
 import pandas as pd
-import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # Ensure parent directory is on sys.path for local package imports
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
 
-from extractors.utils import make_id
+from extractors.utils import load_config
+from extractors.utils import ENV_TAG_MAP
+from extractors.utils import get_driver
+from extractors.utils import JS_CLICK_HELPERS
+from extractors.utils import make_ids
 from extractors.utils import write_daily_csv
+from extractors.utils import write_daily_jsonl
+from extractors.utils import scrape_urls_in_parallel
 from export.google_sheets import upload_df_to_daily_gsheet_named
 
-# Map CLI env to env tag
-ENV_TAG_MAP = {
-    "staging": "api",
-    "dev": "beta"
-}
-
-# Load configuration from a YAML file
-def load_config():
-    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../config/settings.yaml")
-    print(f"Loading config from: {config_path}")
-    with open(config_path, "r") as file:
-        return yaml.safe_load(file)
-
+# Load configuration from settings.yaml (parsed once, shared across extractors)
 CONFIG = load_config()
 
-# Initialize WebDriver
-def get_driver():
-    options = webdriver.ChromeOptions()
-    options.add_argument("--headless")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--window-size=1920,1080")
-    driver = webdriver.Chrome(options=options)
-    return driver
-
-def safe_click(driver, el, retries=3):
-    """Wait until clickable; if intercepted, brief pause + JS click fallback."""
-    for _ in range(retries):
-        try:
-            # ensure it’s visible & enabled first
-            WebDriverWait(driver, 10).until(EC.element_to_be_clickable(el))
-            driver.execute_script("arguments[0].scrollIntoView({block:'center'});", el)
-            el.click()
-            return
-        except ElementClickInterceptedException:
-            time.sleep(0.7)
-            try:
-                driver.execute_script("arguments[0].click();", el)
-                return
-            except Exception:
-                time.sleep(0.3)
-        except Exception:
-            time.sleep(0.3)
-    # last resort
-    driver.execute_script("arguments[0].click();", el)
-
-# Function to extract actions from a page
-def extract_actions(driver, url, date_range, xpaths):
-    actions_data = []
-
-    WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, xpaths["actions_buttons"])))
-    action_buttons = driver.find_elements(By.XPATH, xpaths["actions_buttons"])
-
-    for button in action_buttons:
-        try:
-            strategy_text = button.find_element(By.XPATH, "./span[1]").text.strip()
-            strategy = strategy_text + " (action)"
-        except:
-            strategy = "N/A"
-
-        try:
-            value_text = button.find_element(By.XPATH, "./span[2]").text.strip().replace(",", "")  # Remove thousands separator
-            value = value_text if value_text.replace(",", "").isdigit() else "N/A"
-        except:
-            value = "N/A"
-
-        collection_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Human-readable timestamp
-        page_url = driver.current_url  # Capture current page URL
-        row = {
-            "range": date_range,
-            "figure": strategy,
-            "value": value,
-            "url": page_url,
-            "collection_time": collection_time,
-        }
-        row["id"] = make_id(row["range"], row["figure"], "actions", row["url"])
-        actions_data.append(row)
-    return actions_data
-
-# Main function to process all URLs
-def scrape_actions(env):
-    driver = get_driver()
-    all_actions = []
+def fast_goto(driver, url, timeout=15):
+    """
+    Navigate with CDP Page.navigate (skips WebDriver's blocking Navigate command)
+    and wait until the *new* document is interactive. The flag set on the old
+    window tells the two documents apart.
+    """
+    driver.execute_script("window.__oarLeaving = true;")
+    driver.execute_cdp_cmd("Page.navigate", {"url": url})
+    WebDriverWait(driver, timeout, ignored_exceptions=(JavascriptException,)).until(
+        lambda d: d.execute_script("return !window.__oarLeaving && document.readyState !== 'loading';")
+    )
+
+# Click each date-range button in turn, wait until the action buttons have changed
+# from their pre-click values and the DOM is quiet (see JS_CLICK_HELPERS), and read
+# every visible action button as [label, value]. Runs entirely in the page: one
+# WebDriver call per URL.
+CLICK_AND_READ_JS = JS_CLICK_HELPERS + """
+const [yearXpath, allTimeXpath, actionsXpath, quietMs, timeoutMs, presenceMs] = arguments;
+const done = arguments[arguments.length - 1];
+const read = () => nodes(actionsXpath).map((li) => {
+  const spans = li.querySelectorAll(':scope > span');
+  return [spans[0] ? spans[0].innerText.trim() : null,
+          spans[1] ? spans[1].innerText.trim() : null];
+});
+const buttons = nodes(yearXpath).slice(0, 2);
+const allTime = nodes(allTimeXpath)[0];
+if (allTime) buttons.push(allTime);
+clickAndRead(buttons, read, quietMs, timeoutMs, presenceMs).then(
+  (ranges) => done({hasAllTime: Boolean(allTime), ranges}),
+  (err) => done({error: String(err)}),
+);
+"""
+
+# Output columns, in order
+COLUMNS = ["range", "figure", "value", "url", "collection_time", "id"]
+
+# Turn [label, value] pairs into (figures, values)
+def parse_actions(rows):
+    figures, values = [], []
+    for strategy_text, value_text in rows:
+        figures.append(strategy_text + " (action)" if strategy_text is not None else "N/A")
+
+        value_text = (value_text or "").replace(",", "")  # Remove thousands separator
+        values.append(value_text if value_text.isdigit() else "N/A")
+    return figures, values
+
+# Scrape the two recent years + all time for a single URL into parallel column lists
+def scrape_actions_url(driver, url, xpaths):
+    cols = {"range": [], "figure": [], "value": [], "url": [], "collection_time": []}
+
+    print(f"Scraping: {url}")
+    fast_goto(driver, url)
+    try:
+        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, xpaths["year_buttons"])))
+    except TimeoutException:
+        pass
+
+    year_buttons = driver.find_elements(By.XPATH, xpaths["year_buttons"])
+    if len(year_buttons) < 2:
+        print("Skipping due to missing year buttons")
+        return cols
+
+    # Each click waits up to data_load for new values, then up to 10s more for any
+    # values at all (the old sleep + presence wait)
+    data_load = CONFIG["delays"]["data_load"]
+    driver.set_script_timeout(3 * (data_load + 10) + 10)
+    result = driver.execute_async_script(
+        CLICK_AND_READ_JS,
+        xpaths["year_buttons"], xpaths["all_time_button"], xpaths["actions_buttons"],
+        250, data_load * 1000, 10_000,
+    )
+    if "error" in result:
+        raise RuntimeError(f"Actions extraction failed for {url}: {result['error']}")
+    if not result["hasAllTime"]:
+        print("No all-time button found.")
+
+    # Extract actions for each date range (one timestamp per page, stored with the
+    # rows so a same-day rerun served from the page cache keeps the original time)
+    collection_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for r in result["ranges"]:
+        figures, values = parse_actions(r["rows"])
+        cols["range"].extend([r["range"]] * len(figures))
+        cols["figure"].extend(figures)
+        cols["value"].extend(values)
+        cols["url"].extend([r["url"]] * len(figures))
+        cols["collection_time"].extend([collection_time] * len(figures))
+
+    return cols
+
+# Main function to process all URLs (one headless Chrome per worker thread)
+def scrape_actions(env, page_cache=True):
     xpaths = CONFIG["xpaths"]
     urls = CONFIG.get("actions_urls", {}).get(env, [])
 
-    for url in urls:
-        print(f"Scraping: {url}")
-        driver.get(url)
-        time.sleep(CONFIG["delays"]["page_load"])
-
-        year_buttons = driver.find_elements(By.XPATH, xpaths["year_buttons"])
-        if len(year_buttons) < 2:
-            print("Skipping due to missing year buttons")
-            continue
-
-        # Extract actions for each date range
-        for i, button in enumerate(year_buttons[:2]):
-            safe_click(driver, button)
-            time.sleep(CONFIG["delays"]["data_load"])
-            date_range = button.text.strip()
-            all_actions.extend(extract_actions(driver, url, date_range, xpaths))
-
-        try:
-            all_time_button = driver.find_element(By.XPATH, xpaths["all_time_button"])
-            safe_click(driver, all_time_button)
-            time.sleep(CONFIG["delays"]["data_load"])
-            date_range = all_time_button.text.strip()
-            all_actions.extend(extract_actions(driver, url, date_range, xpaths))
-        except:
-            print("No all-time button found.")
-
-    driver.quit()
-    return all_actions
+    per_url = scrape_urls_in_parallel(
+        urls,
+        lambda driver, url: scrape_actions_url(driver, url, xpaths),
+        # eager: fast_goto only needs DOMContentLoaded before polling for the buttons
+        make_driver=lambda: get_driver(page_load_strategy="eager"),
+        max_workers=CONFIG.get("chrome", {}).get("parallel", 4),
+        cache_section="actions" if page_cache else None,
+    )
+
+    # Concatenate the per-URL columns, build the frame in one go, then add row IDs
+    df = pd.DataFrame(
+        {c: [v for cols in per_url for v in cols[c]] for c in COLUMNS[:-1]},
+        columns=COLUMNS[:-1],
+    )
+    df["id"] = make_ids(df["range"], df["figure"], "actions", df["url"])
+    return df
 
 # Run the scraper and export to CSV
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--env", choices=["staging", "dev"], required=True,
                         help="Specify environment: staging, dev")
+    parser.add_argument("--local", "--csv", dest="local", action=argparse.BooleanOptionalAction, default=True,
+                        help="Also write the gzipped daily file under snapshots/ (default: on; "
+                             "--csv/--no-csv are deprecated aliases)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv",
+                        help="Format of the daily file (default: csv)")
+    parser.add_argument("--page-cache", action=argparse.BooleanOptionalAction, default=True,
+                        help="Reuse pages already scraped today from .cache/ (default: on). "
+                             "A same-day rerun then re-uploads those cached rows over today's "
+                             "Drive sheet; use --no-page-cache to scrape every page again")
     args = parser.parse_args()
 
-    actions_data = scrape_actions(args.env)
-    df = pd.DataFrame(
-        actions_data,
-        columns=["range", "figure", "value", "url", "collection_time", "id"],
-    )
+    df = scrape_actions(args.env, page_cache=args.page_cache)
 
     if df.empty:
         print(f"[info] Actions: no rows for env={args.env}. Skipping CSV and Google Sheets upload.")
@@ -160,24 +168,26 @@ def main():
     creds_path = CONFIG["google_sheets"]["creds_file"]
     folder_id  = CONFIG["google_sheets"]["folder_id"]
 
-    # Map CLI env to env tag
-    ENV_TAG_MAP = {"staging": "api", "dev": "beta"}
     env_tag = ENV_TAG_MAP[args.env]
 
-    from extractors.utils import write_daily_csv
-    from export.google_sheets import upload_df_to_daily_gsheet_named
-
-    write_daily_csv(df=df, env_tag=env_tag, section="actions",
-                    out_dir="snapshots", tz="Europe/London")
-
-    upload_df_to_daily_gsheet_named(
-        df=df,
-        env_tag=env_tag,
-        section="actions",
-        folder_id=folder_id,
-        creds_path=creds_path,
-        tz="Europe/London",
-    )
+    # Upload on a background thread while the local CSV is written
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        upload = ex.submit(
+            upload_df_to_daily_gsheet_named,
+            df=df,
+            env_tag=env_tag,
+            section="actions",
+            folder_id=folder_id,
+            creds_path=creds_path,
+            tz="Europe/London",
+        )
+
+        if args.local:
+            write_daily = write_daily_jsonl if args.format == "jsonl" else write_daily_csv
+            write_daily(df=df, env_tag=env_tag, section="actions",
+                        out_dir="snapshots", tz="Europe/London")
+
+        upload.result()  # re-raise any upload error
 
 if __name__ == "__main__":
     main()
@@ -1,51 +1,42 @@
 import os
 import sys
 import re
-import yaml
 import argparse
+import numpy as np
 import pandas as pd
+import xlsxwriter
 from datetime import datetime
-from openpyxl import load_workbook
-from openpyxl.styles import Font, PatternFill
 from collections import defaultdict
 
-# Allows "from export.google_sheets import load_gsheet_to_df"
+# Allows "from export.google_sheets import load_multi_gsheet_to_df"
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from export.google_sheets import load_gsheet_to_df
+from export.google_sheets import CACHE_DIR, load_multi_gsheet_to_df
+from extractors.utils import load_config
 
 ##############################################
 # 1. Load config and define whole-number sets
 ##############################################
-def load_config():
-    config_path = os.path.join(os.path.dirname(__file__), "..", "config", "settings.yaml")
-    print(f"Loading config from: {config_path}")
-    with open(config_path, "r") as f:
-        return yaml.safe_load(f)
-
 CONFIG = load_config()
 
-INSIGHTS_WHOLE_NUMBER_METRICS = {
+INSIGHTS_WHOLE_NUMBER_METRICS = frozenset({
     "Total publications (insight)",
     "Total preprints (insight)"
-}
-EXPLORE_WHOLE_NUMBER_METRICS = {
+})
+EXPLORE_WHOLE_NUMBER_METRICS = frozenset({
     "PUBLICATIONS",
     "Total APC amount",
     "Mean APC amount",
     "Median APC amount"
-}
+})
+
+# https://dev.oa.report/gates-foundation?orgkey=abc => gates-foundation
+_ORG_PAT = re.compile(r"\.report/([^?/]+)")
+# '%' and thousands separators stripped before parsing a value
+_NUM_CLEAN = re.compile(r"[%,]")
 
 ##############################################
 # 2. Basic Helpers
 ##############################################
-def filter_by_date(df, date_str):
-    """Keep only rows whose collection_time starts with YYYY-MM-DD."""
-    return df[df["collection_time"].str.startswith(date_str)]
-
-def extract_org_from_url(url):
-    """Given https://dev.oa.report/gates-foundation?orgkey=abc => gates-foundation."""
-    return url.split(".report/")[1].split("?")[0].strip("/")
-
 def format_date_label(date_str):
     """'2025-03-24' => '24 Mar' (for Windows => '%#d %b', else '%-d %b')."""
     try:
@@ -57,84 +48,110 @@ def format_date_label(date_str):
 ##############################################
 # 3. Compare numeric values
 ##############################################
-def compare_values(old, new, is_whole):
+def _to_number(series):
+    """Raw values => nullable Float64 ('%' and ',' stripped; unparseable => <NA>)."""
+    cleaned = series.astype(str).str.replace(_NUM_CLEAN, "", regex=True).str.strip()
+    return pd.to_numeric(cleaned, errors="coerce").astype("Float64")
+
+def _coerce(series, parsed=None):
+    """float64 array for raw values (or their already-parsed numbers); missing => NaN."""
+    if parsed is None:
+        parsed = _to_number(series)
+    return parsed.to_numpy(dtype=float, na_value=np.nan)
+
+def compare_columns(old_raw, new_raw, is_whole, old_num=None, new_num=None):
     """
+    Compare two aligned Series of raw values, column-wise.
+    old_num/new_num: the same values already parsed by _to_number (skips re-parsing).
     If is_whole=False => treat as percentage => /100.
     If both old & new ~ 0 => 0% (not inf).
     If old=0 & new!=0 => inf.
+    If either side doesn't parse => raw values (or N/A) and N/A changes.
     Round to consistent decimals.
     """
-    try:
-        old_val = float(str(old).replace("%", "").replace(",", ""))
-        new_val = float(str(new).replace("%", "").replace(",", ""))
-        if not is_whole:
-            old_val /= 100
-            new_val /= 100
-
-        delta = new_val - old_val
-        if abs(old_val) < 1e-12 and abs(new_val) < 1e-12:
-            pct = 0
-        elif abs(old_val) < 1e-12:
-            pct = float("inf")
-        else:
-            pct = (delta / old_val) * 100
-
-        return round(new_val, 4), round(old_val, 4), round(delta, 4), round(pct, 2)
-    except:
-        return ("N/A" if pd.isna(new) else new,
-                "N/A" if pd.isna(old) else old,
-                "N/A",
-                "N/A")
+    old_v, new_v = _coerce(old_raw, old_num), _coerce(new_raw, new_num)
+    old_v = np.where(~is_whole, old_v / 100.0, old_v)
+    new_v = np.where(~is_whole, new_v / 100.0, new_v)
+    ok = ~np.isnan(old_v) & ~np.isnan(new_v)
+
+    delta = new_v - old_v
+    old_zero = np.abs(old_v) < 1e-12
+    pct = np.divide(delta, old_v, out=np.full_like(delta, np.inf), where=~old_zero) * 100
+    pct = np.where(old_zero & (np.abs(new_v) < 1e-12), 0.0, pct)
+
+    def _numeric_or(values, fallback):
+        return pd.Series(values, index=old_raw.index, dtype=object).where(ok, fallback)
+
+    return {
+        "Old": _numeric_or(np.round(old_v, 4), _or_na(old_raw)),
+        "New": _numeric_or(np.round(new_v, 4), _or_na(new_raw)),
+        "Change": _numeric_or(np.round(delta, 4), "N/A"),
+        "% Change": _numeric_or(np.round(pct, 2), "N/A"),
+    }
+
+def _or_na(series):
+    return series.astype(object).where(series.notna(), "N/A")
+
+def _one_sided(raw, side):
+    """
+    Only one date has data (org onboarded/offboarded): raw values on that side,
+    N/A everywhere else -- what compare_columns yields, minus the numeric pass.
+    """
+    present = _or_na(raw)
+    return {
+        "Old": present if side == "old" else "N/A",
+        "New": present if side == "new" else "N/A",
+        "Change": "N/A",
+        "% Change": "N/A",
+    }
 
 ##############################################
 # 4. Merging logic for Insights & Actions
 ##############################################
 def process_rows_by_key(old_df, new_df, key_col, date_col):
     """
-    Outer approach => keep all combos, 
-    then compare old vs new for each (key_col, date_col).
+    Outer merge on (key_col, date_col) => keep all combos,
+    then compare old vs new for every combo at once (column-wise).
     """
-    # unify column name => 'Value'
-    if "Value" not in old_df and "value" in old_df:
-        old_df = old_df.rename(columns={"value": "Value"})
-    if "Value" not in new_df and "value" in new_df:
-        new_df = new_df.rename(columns={"value": "Value"})
-
-    old_keys = old_df[[key_col, date_col]].drop_duplicates()
-    new_keys = new_df[[key_col, date_col]].drop_duplicates()
-
-    combos = pd.merge(old_keys, new_keys, how="outer", on=[key_col, date_col])
+    # unify column name => 'Value' (on the selected columns, not the whole frame);
+    # Value_num (parsed once per section) rides along when present
+    def _pick(df):
+        value_col = "Value" if "Value" in df else "value"
+        extra = ["Value_num"] if "Value_num" in df else []
+        return df[[key_col, date_col, value_col] + extra].set_axis(
+            [key_col, date_col, "Value"] + extra, axis=1)
+
+    # only one side has rows => nothing to merge or compare
+    if old_df.empty or new_df.empty:
+        side = "new" if old_df.empty else "old"
+        present = _pick(new_df if old_df.empty else old_df).drop_duplicates([key_col, date_col])
+        return pd.DataFrame({
+            "DATE_RANGE": _or_na(present[date_col]),
+            "METRIC": _or_na(present[key_col]),
+            **_one_sided(present["Value"], side),
+        })
 
-    results = []
-    for _, row in combos.iterrows():
-        metric = row[key_col]
-        dr = row[date_col]
+    # first value per (key, date) on each side, then one outer merge
+    merged = pd.merge(
+        _pick(old_df).drop_duplicates([key_col, date_col]),
+        _pick(new_df).drop_duplicates([key_col, date_col]),
+        how="outer",
+        on=[key_col, date_col],
+        suffixes=("_old", "_new"),
+        validate="one_to_one",
+    )
 
-        old_part = old_df[(old_df[key_col] == metric) & (old_df[date_col] == dr)]
-        new_part = new_df[(new_df[key_col] == metric) & (new_df[date_col] == dr)]
+    # insights are percentages unless listed as whole numbers; actions => all whole
+    metric = merged[key_col]
+    is_insight = metric.astype(str).str.contains("(insight)", regex=False)
+    is_whole = (~is_insight | metric.isin(INSIGHTS_WHOLE_NUMBER_METRICS)).to_numpy()
 
-        val_old = old_part["Value"].values[0] if not old_part.empty else "N/A"
-        val_new = new_part["Value"].values[0] if not new_part.empty else "N/A"
-
-        # If it's an insight => check if it's in the WHOLE set
-        if "(insight)" in str(metric) and metric in INSIGHTS_WHOLE_NUMBER_METRICS:
-            is_whole = True
-        elif "(insight)" in str(metric):
-            is_whole = False
-        else:
-            # actions => all whole
-            is_whole = True
-
-        newv, oldv, delta, pct = compare_values(val_old, val_new, is_whole)
-        results.append({
-            "DATE_RANGE": dr if pd.notna(dr) else "N/A",
-            "METRIC": metric if pd.notna(metric) else "N/A",
-            "Old": oldv,
-            "New": newv,
-            "Change": delta,
-            "% Change": pct
-        })
-    return pd.DataFrame(results)
+    return pd.DataFrame({
+        "DATE_RANGE": _or_na(merged[date_col]),
+        "METRIC": _or_na(metric),
+        **compare_columns(merged["Value_old"], merged["Value_new"], is_whole,
+                          merged.get("Value_num_old"), merged.get("Value_num_new")),
+    })
 
 ##############################################
 # 5. Merging logic for Explore
@@ -148,39 +165,35 @@ def process_explore_section(old_df, new_df):
     all_cols = list(set(old_df.columns).union(new_df.columns))
     metrics = [c for c in all_cols if c not in skip_cols]
 
-    # unify keys (outer)
-    old_keys = old_df["KEY"].drop_duplicates()
-    new_keys = new_df["KEY"].drop_duplicates()
-    combos = pd.merge(old_keys.to_frame("KEY"), new_keys.to_frame("KEY"), how="outer", on="KEY")
-
-    results = []
-    for dr in combos["KEY"].unique():
-        old_part = old_df[old_df["KEY"] == dr]
-        new_part = new_df[new_df["KEY"] == dr]
-
-        for metric in metrics:
-            val_old = old_part.iloc[0][metric] if (not old_part.empty and metric in old_part.columns) else "N/A"
-            val_new = new_part.iloc[0][metric] if (not new_part.empty and metric in new_part.columns) else "N/A"
-
-            # if metric in EXPLORE_WHOLE_NUMBER_METRICS => treat as whole
-            is_whole = metric in EXPLORE_WHOLE_NUMBER_METRICS
-            newv, oldv, delta, pct = compare_values(val_old, val_new, is_whole)
-
-            results.append({
-                "DATE_RANGE": dr if pd.notna(dr) else "N/A",
-                "METRIC": metric,
-                "Old": oldv,
-                "New": newv,
-                "Change": delta,
-                "% Change": pct
-            })
-    return pd.DataFrame(results)
+    # first row per KEY on each side, aligned on the union of keys × all metrics
+    old_w = old_df.drop_duplicates("KEY").set_index("KEY")
+    new_w = new_df.drop_duplicates("KEY").set_index("KEY")
+    keys = old_w.index.union(new_w.index)
+    old_w = old_w.reindex(index=keys, columns=metrics)
+    new_w = new_w.reindex(index=keys, columns=metrics)
+
+    # flatten (n_keys, n_metrics) grids to long form: one row per (KEY, metric)
+    n_keys = len(keys)
+    long_index = pd.RangeIndex(n_keys * len(metrics))
+    old_raw = pd.Series(old_w.to_numpy(dtype=object).ravel(), index=long_index)
+    new_raw = pd.Series(new_w.to_numpy(dtype=object).ravel(), index=long_index)
+    if old_df.empty or new_df.empty:
+        values = _one_sided(new_raw, "new") if old_df.empty else _one_sided(old_raw, "old")
+    else:
+        whole_mask = np.array([m in EXPLORE_WHOLE_NUMBER_METRICS for m in metrics], dtype=bool)
+        values = compare_columns(old_raw, new_raw, np.tile(whole_mask, n_keys))
+
+    return pd.DataFrame({
+        "DATE_RANGE": _or_na(pd.Series(np.repeat(keys.to_numpy(dtype=object), len(metrics)), index=long_index)),
+        "METRIC": np.tile(np.array(metrics, dtype=object), n_keys),
+        **values,
+    })
 
 ##############################################
 # 6. Master aggregator per section
 ##############################################
-def process_section(section, sheet_name, creds_path, date1, date2):
-    df = load_gsheet_to_df(sheet_name, creds_path)
+def process_section(section, sheet_name, df, date1, date2):
+    # df: the section's sheet, already fetched (by load_multi_gsheet_to_df in main)
     if df.empty:
         print(f"Sheet {sheet_name} is empty! No data.")
         return {}
@@ -191,25 +204,35 @@ def process_section(section, sheet_name, creds_path, date1, date2):
         print(f"No org_url-like col for section {section}, skipping.")
         return {}
 
-    # attach org
-    df["org"] = df[url_col].apply(extract_org_from_url)
+    # attach org (vectorised; URLs that don't match are kept as-is)
+    urls = df[url_col].astype(str)
+    df = df.assign(org=urls.str.extract(_ORG_PAT, expand=False).fillna(urls))
+
+    # insights/actions: parse the value column once for every org and date
+    if section != "explore":
+        value_col = "Value" if "Value" in df else "value"
+        df = df.assign(Value_num=_to_number(df[value_col]))
+
+    # Bucket rows by (org, YYYY-MM-DD) in one pass; old/new are then dict lookups.
+    # The date key is a separate Series so it never shows up as an explore metric.
+    dates = df["collection_time"].astype(str).str[:10]
+    buckets = dict(iter(df.groupby([df["org"], dates], sort=False)))
+    empty = df.iloc[:0]
 
-    # Filter old/new
     results_by_org = {}
     for org in df["org"].unique():
-        subset = df[df["org"] == org]
-        df_old = filter_by_date(subset, date1)
-        df_new = filter_by_date(subset, date2)
+        df_old = buckets.get((org, date1), empty)
+        df_new = buckets.get((org, date2), empty)
 
         # if no data in either => skip
         if df_old.empty and df_new.empty:
             continue
 
         if section == "explore":
-            out = process_explore_section(df_old.copy(), df_new.copy())
+            out = process_explore_section(df_old, df_new)
         else:
             key_col = "Insight" if section == "insights" else "strategy"
-            out = process_rows_by_key(df_old.copy(), df_new.copy(), key_col=key_col, date_col="date_range")
+            out = process_rows_by_key(df_old, df_new, key_col=key_col, date_col="date_range")
 
         if not out.empty:
             results_by_org.setdefault(org, []).append(out)
@@ -219,28 +242,65 @@ def process_section(section, sheet_name, creds_path, date1, date2):
 ##############################################
 # 7. Final styling
 ##############################################
-def apply_styling(workbook):
-    """Color Red if % Change=0, Bold if |% Change|>=1, grey fill for last two cols."""
-    red_font = Font(color="9C0006")
-    bold_font = Font(bold=True)
-    grey_fill = PatternFill(start_color="EEEEEE", end_color="EEEEEE", fill_type="solid")
-
-    for ws in workbook.worksheets:
-        for row in ws.iter_rows(min_row=2):
-            # 'Change' => col idx=4, '% Change' => col idx=5
-            change_cell = row[4]
-            pct_cell = row[5]
-            try:
-                pct_val = float(pct_cell.value)
-                if abs(pct_val) < 1e-9:
-                    pct_cell.font = red_font
-                elif abs(pct_val) >= 1:
-                    change_cell.font = bold_font
-                    pct_cell.font = bold_font
-            except:
-                pass
-            change_cell.fill = grey_fill
-            pct_cell.fill = grey_fill
+def add_formats(book):
+    """xlsxwriter formats for the snapshot sheets (created once per workbook)."""
+    return {
+        "grey": book.add_format({"bg_color": "#EEEEEE"}),
+        # red/bold carry the grey fill too: Google Sheets and LibreOffice apply only
+        # the first matching conditional rule, not a merge of all of them
+        "red": book.add_format({"font_color": "#9C0006", "bg_color": "#EEEEEE"}),
+        "bold": book.add_format({"bold": True, "bg_color": "#EEEEEE"}),
+        # same look as the pandas to_excel header
+        "header": book.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"}),
+    }
+
+def unique_sheet_name(name, seen):
+    """
+    Excel sheet name for name: cut to 31 chars, with a numeric suffix if it clashes
+    (case-insensitively) with one in seen, as openpyxl did ('HHMI', 'hhmi' => 'hhmi1').
+    The chosen name is added to seen.
+    """
+    candidate, n = name[:31], 0
+    while candidate.casefold() in seen:
+        n += 1
+        candidate = f"{name[:31 - len(str(n))]}{n}"
+    seen.add(candidate.casefold())
+    return candidate
+
+def write_sheet(ws, df, formats):
+    """
+    Header + rows, strictly in row order (constant_memory flushes each row once
+    the next one starts, so pandas' column-by-column to_excel would lose cells).
+    NaN => "" and ±inf => "inf"/"-inf", as to_excel writes them.
+    """
+    ws.write_row(0, 0, [str(c) for c in df.columns], formats["header"])
+    body = df.astype(object).replace({np.inf: "inf", -np.inf: "-inf"})
+    body = body.where(df.notna(), "")
+    for i, row in enumerate(body.itertuples(index=False, name=None), start=1):
+        ws.write_row(i, 0, row)
+
+def apply_styling(ws, n_rows, formats):
+    """
+    Color Red if % Change=0, Bold if |% Change|>=1, grey fill for last two cols.
+    Stored as conditional rules over the data rows, so no per-cell styling pass.
+    The grey catch-all goes last: viewers that apply only the first matching rule
+    (Google Sheets, LibreOffice) would otherwise never show red or bold.
+    """
+    if n_rows == 0:
+        return
+    # 'Change' => column E (idx 4), '% Change' => column F (idx 5)
+    ws.conditional_format(1, 5, n_rows, 5, {
+        "type": "cell", "criteria": "==", "value": 0, "format": formats["red"],
+    })
+    # % Change can be a number, "inf" (old value 0) or "N/A"
+    ws.conditional_format(1, 4, n_rows, 5, {
+        "type": "formula",
+        "criteria": '=OR($F2="inf",AND(ISNUMBER($F2),ABS($F2)>=1))',
+        "format": formats["bold"],
+    })
+    ws.conditional_format(1, 4, n_rows, 5, {
+        "type": "formula", "criteria": "=TRUE", "format": formats["grey"],
+    })
 
 ##############################################
 # 8. Main
@@ -251,6 +311,8 @@ def main():
     parser.add_argument("--date1", required=True)  # e.g. '2025-03-24'
     parser.add_argument("--date2", required=True)  # e.g. '2025-03-25'
     parser.add_argument("--year", required=True)   # e.g. '2025'
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help="Local cache for downloaded sheets ('' to disable)")
     args = parser.parse_args()
 
     creds_path = os.path.join(
@@ -260,24 +322,28 @@ def main():
     )
     sheets_map = CONFIG["google_sheets"]["sheets"]
     output_file = f"qa_snapshot_{args.year}.xlsx"
-    writer = pd.ExcelWriter(output_file, engine="openpyxl")
+    # constant_memory: rows are streamed to disk as written, not held per workbook
+    book = xlsxwriter.Workbook(output_file, {"constant_memory": True, "strings_to_numbers": False})
+    formats = add_formats(book)
     all_results = defaultdict(list)
 
+    # Fetch all three section sheets up front (concurrently)
+    sections = ["insights","actions","explore"]
+    frames = load_multi_gsheet_to_df({s: sheets_map[s][args.env] for s in sections},
+                                     creds_path, cache_dir=args.cache_dir or None)
+
     # Gather data from insights, actions, explore
-    for section in ["insights","actions","explore"]:
+    for section in sections:
         sheet_name = sheets_map[section][args.env]
         print(f"Processing {section} from {sheet_name} for {args.date1} vs {args.date2}")
-        sec_result = process_section(section, sheet_name, creds_path, args.date1, args.date2)
+        sec_result = process_section(section, sheet_name, frames[section], args.date1, args.date2)
         for org, df_list in sec_result.items():
             all_results[org].extend(df_list)
 
-    from openpyxl import load_workbook
-
-    # Write each org to its own sheet
-    for org, dataframes in all_results.items():
-        if not dataframes:
-            continue
-        combined = pd.concat(dataframes, ignore_index=True)
+    # One frame for every org: relabel, reorder and sort once, then split per org
+    pieces = [df.assign(org=org) for org, dfs in all_results.items() for df in dfs]
+    if pieces:
+        combined = pd.concat(pieces, ignore_index=True)
 
         # Insert date-labeled columns
         old_label = f"Old ({format_date_label(args.date1)})"
@@ -288,17 +354,23 @@ def main():
         # Rename 'FIGURE' -> 'METRIC'
         combined.rename(columns={"FIGURE": "METRIC"}, inplace=True)
 
-        # Sort by DATE_RANGE => METRIC
-        combined.sort_values(["DATE_RANGE", "METRIC"], inplace=True, na_position="last")
+        # Sort by DATE_RANGE => METRIC (stable, so each org's slice stays sorted)
+        combined.sort_values(["DATE_RANGE", "METRIC"], inplace=True, na_position="last", kind="stable")
+        by_org = combined.groupby("org", sort=False)
 
-        combined.to_excel(writer, sheet_name=org[:31], index=False)
+        # Write each org to its own sheet, in the order orgs were first seen
+        sheet_names = set()
+        for org in all_results:
+            if org not in by_org.groups:
+                continue
+            sub = by_org.get_group(org).drop(columns="org")
+            ws = book.add_worksheet(unique_sheet_name(org, sheet_names))
+            write_sheet(ws, sub, formats)
 
-    writer.close()
+            # Styling rules are written alongside the data (no re-open after close)
+            apply_styling(ws, len(sub), formats)
 
-    # Apply styling
-    wb = load_workbook(output_file)
-    apply_styling(wb)
-    wb.save(output_file)
+    book.close()
     print(f"QA snapshot saved to {output_file}")
 
 if __name__=="__main__":
@@ -3,12 +3,11 @@
 
 import os
 import sys
-import yaml
 import argparse
+import heapq
 import pandas as pd
-import time
 from datetime import datetime
-from selenium import webdriver
+from concurrent.futures import ThreadPoolExecutor
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -19,88 +18,170 @@ ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
 
-from extractors.utils import make_id
+from extractors.utils import load_config
+from extractors.utils import ENV_TAG_MAP
+from extractors.utils import get_driver
+from extractors.utils import make_ids
 from extractors.utils import write_daily_csv
+from extractors.utils import write_daily_jsonl
+from extractors.utils import scrape_urls_in_parallel
 from export.google_sheets import upload_df_to_daily_gsheet_named
 
-# Map CLI env to env tag
-ENV_TAG_MAP = {
-    "staging": "api",
-    "dev": "beta"
-}
-
 # --------------------------------------------------------------------------- #
 #  Configuration
 # --------------------------------------------------------------------------- #
-CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../config/settings.yaml")
-with open(CONFIG_PATH, "r") as f:
-    CONFIG = yaml.safe_load(f)
+CONFIG = load_config()
+
+# Output columns, in order
+COLUMNS = ["range", "figure", "value", "url", "collection_time", "id"]
 
 # --------------------------------------------------------------------------- #
 #  Selenium helpers
 # --------------------------------------------------------------------------- #
-def get_driver():
-    options = webdriver.ChromeOptions()
-    options.add_argument("--headless")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--window-size=1920,1080")
-    return webdriver.Chrome(options=options)
-
-def extract_table_data(driver):
-    WebDriverWait(driver, 10).until(
-        EC.presence_of_element_located((By.ID, "explore_table"))
-    )
-
-    # Wait until either the table header or a "No results found" message appears.
+# State of #explore_table, read in the page in one call: null until the table has
+# rendered a header or body cells, else its "No results found" flag plus header (th)
+# and body (td) text
+TABLE_JS = """
+const table = document.getElementById('explore_table');
+if (!table) return null;
+const headerRow = table.querySelector('thead tr');
+const cells = table.querySelectorAll('tbody tr td');
+if (!headerRow && !cells.length) return null;
+const text = (cells) => Array.from(cells, (c) => c.innerText.trim());
+return {
+  noResults: Array.from(cells).some((td) => td.textContent.includes('No results found')),
+  headers: headerRow ? text(headerRow.querySelectorAll('th')) : [],
+  rows: Array.from(table.querySelectorAll('tbody tr'), (r) => text(r.querySelectorAll('td'))),
+};
+"""
+
+def click_and_wait_for_table(driver, el, timeout):
+    """
+    JS-click `el`, then wait until the explore table body present before the
+    click is replaced (table re-rendered) and the new body has rows. Each wait
+    gives up after `timeout` seconds, e.g. when the click leaves the table as it was.
+    """
+    old_body = next(iter(driver.find_elements(By.CSS_SELECTOR, "#explore_table tbody")), None)
+    driver.execute_script("arguments[0].click();", el)
     try:
-        WebDriverWait(driver, 10).until(
-            lambda d: (
-                d.find_elements(By.XPATH, "//table[@id='explore_table']//thead/tr")
-                or d.find_elements(By.XPATH, "//table[@id='explore_table']//tbody//td[contains(., 'No results found')]")
-                or d.find_elements(By.XPATH, "//table[@id='explore_table']//tbody/tr/td")
-            )
+        if old_body is not None:
+            WebDriverWait(driver, timeout).until(EC.staleness_of(old_body))
+        WebDriverWait(driver, timeout).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, "#explore_table tbody tr"))
         )
     except TimeoutException:
-        return []
+        pass
 
-    # If the table explicitly reports no results, bail out early.
-    no_results = driver.find_elements(
-        By.XPATH, "//table[@id='explore_table']//tbody//td[contains(., 'No results found')]"
-    )
-    if no_results:
-        return []
+def extract_table_data(driver):
+    # Poll until the table header, body cells or a "No results found" message appear;
+    # each poll is the full read, so the last one already holds the data.
+    table = WebDriverWait(driver, 10).until(lambda d: d.execute_script(TABLE_JS))
 
-    # Get headers
-    header_rows = driver.find_elements(By.XPATH, "//table[@id='explore_table']//thead/tr")
-    if not header_rows:
-        # Header row may be missing when the table is empty.
+    # If the table explicitly reports no results (or has no header), bail out early.
+    if table["noResults"] or not table["headers"]:
         return []
-    header_row = header_rows[0]
-    headers = [th.text.strip() for th in header_row.find_elements(By.TAG_NAME, "th")]
+    headers = table["headers"]
 
-    # Get body rows; if none, this will just return []
-    data = []
-    for row in driver.find_elements(By.XPATH, "//table[@id='explore_table']//tbody/tr"):
-        cells = row.find_elements(By.TAG_NAME, "td")
-        values = [cell.text.strip() for cell in cells]
-        if len(values) != len(headers):
-            # skip "No results found" row or malformed rows
-            continue
-        data.append(dict(zip(headers, values)))
-
-    return data
+    # Body rows; if none, this will just return []
+    return [
+        dict(zip(headers, values))
+        for values in table["rows"]
+        if len(values) == len(headers)   # skip malformed rows
+    ]
 
 # --------------------------------------------------------------------------- #
 #  Core scraping routine
 # --------------------------------------------------------------------------- #
-def scrape_explore(env):
+def scrape_explore_url(driver, url, xpaths, delay_cfg, years_to_keep):
     """
-    For every URL in settings.yaml → explore_urls[env]:
+    For one explore URL:
         • load page
         • switch to: All-time / yearly view / raw numbers
         • extract table (“All articles”)
         • if the “Preprints” radio is present, click it, re-extract table
+    Returns flattened rows (one metric per row) as parallel column lists.
+    """
+    cols = {"range": [], "figure": [], "value": [], "url": [], "collection_time": []}
+
+    print(f"→ {url}")
+    driver.get(url)
+
+    # --- 1. Click all-time ---------------------------------------------------------- #
+    # (waiting for the button replaces a fixed page_load sleep)
+    btn_all_time = WebDriverWait(driver, 10).until(
+        EC.element_to_be_clickable((By.XPATH, xpaths["all_time_button"]))
+    )
+    click_and_wait_for_table(driver, btn_all_time, delay_cfg["data_load"])
+
+    # --- 2. Click year-by-year breakdown -------------------------------------------- #
+    btn_year = WebDriverWait(driver, 10).until(
+        EC.element_to_be_clickable((By.ID, "explore_year_button"))
+    )
+    click_and_wait_for_table(driver, btn_year, delay_cfg["data_load"])
+
+    # --- 3. Toggle to raw number mode ----------------------------------------------- #
+    try:
+        toggle = WebDriverWait(driver, 5).until(
+            EC.presence_of_element_located((By.ID, "toggle-data-view"))
+        )
+        if toggle.get_attribute("aria-checked") == "true":   # “%” mode
+            click_and_wait_for_table(driver, toggle, delay_cfg["data_load"])
+            WebDriverWait(driver, 10).until(
+                lambda d: d.find_element(By.ID, "toggle-data-view")
+                          .get_attribute("aria-checked") == "false"
+            )
+    except Exception as e:
+        print(f"[warn] raw-number toggle unavailable: {e}")
+
+    # --- Helper to flatten a table into cols ---------------------------------------- #
+    def _flush_table(table: list[dict], label_suffix: str):
+        if not table:
+            return
+        year_col = next(iter(table[0]))            # first column is Year/KEY
+        # parse each year once; non-numeric keys (None) are always kept, and
+        # years_to_keep <= 0 keeps every year (as the old sorted(...)[-0:] did for 0)
+        years   = [int(r[year_col]) if r[year_col].isdigit() else None for r in table]
+        numeric = {y for y in years if y is not None}
+        recent  = set(heapq.nlargest(years_to_keep, numeric)) if years_to_keep > 0 else numeric
+
+        # every row has the same columns: build the figure labels once per table
+        metrics = [m for m in table[0] if m != year_col]
+        labels  = [f"{m} {label_suffix}" for m in metrics]
+
+        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for r, y in zip(table, years):
+            if y is not None and y not in recent:
+                continue
+            cols["range"].extend([r[year_col]] * len(metrics))
+            cols["figure"].extend(labels)
+            cols["value"].extend(r[m] for m in metrics)
+            cols["url"].extend([url] * len(metrics))
+            cols["collection_time"].extend([ts] * len(metrics))
+
+    # --- 4. Normal publications view ------------------------------------------------ #
+    try:
+        tbl = extract_table_data(driver)
+    except (StaleElementReferenceException, NoSuchElementException, TimeoutException):
+        print("[info] explore table missing/empty; skipping this URL")
+        tbl = []
+    _flush_table(tbl, "(Explore)")
+
+    # --- 5. Optional: Preprints view ------------------------------------------------ #
+    try:
+        radio_pp = driver.find_element(By.ID, "filter_is_preprint")
+        click_and_wait_for_table(driver, radio_pp, delay_cfg["data_load"])
+        tbl_pp = extract_table_data(driver)
+        _flush_table(tbl_pp, "(Explore – Preprints)")
+    except Exception:
+        # radio absent → silently ignore
+        pass
+
+    return cols
+
+def scrape_explore(env, page_cache=True):
+    """
+    Scrape every URL in settings.yaml → explore_urls[env] (see scrape_explore_url),
+    spread over a pool of headless Chrome drivers.
     Returns a flattened DataFrame with one metric per row.
     """
     urls          = CONFIG.get("explore_urls", {}).get(env, [])
@@ -108,95 +189,21 @@ def scrape_explore(env):
     delay_cfg     = CONFIG["delays"]
     years_to_keep = CONFIG["explore"]["years_to_keep"]
 
-    driver   = get_driver()
-    out_rows = []
-
-    for url in urls:
-        print(f"→ {url}")
-        driver.get(url)
-        time.sleep(delay_cfg["page_load"])
-
-        # --- 1. Click all-time ---------------------------------------------------------- #
-        btn_all_time = WebDriverWait(driver, 10).until(
-            EC.element_to_be_clickable((By.XPATH, xpaths["all_time_button"]))
-        )
-        driver.execute_script("arguments[0].click();", btn_all_time)
-        time.sleep(delay_cfg["data_load"])
-
-        # --- 2. Click year-by-year breakdown -------------------------------------------- #
-        btn_year = WebDriverWait(driver, 10).until(
-            EC.element_to_be_clickable((By.ID, "explore_year_button"))
-        )
-        driver.execute_script("arguments[0].click();", btn_year)
-        time.sleep(delay_cfg["data_load"])
+    per_url = scrape_urls_in_parallel(
+        urls,
+        lambda driver, url: scrape_explore_url(driver, url, xpaths, delay_cfg, years_to_keep),
+        make_driver=get_driver,
+        max_workers=CONFIG.get("chrome", {}).get("parallel", 4),
+        cache_section="explore" if page_cache else None,
+    )
 
-        # --- 3. Toggle to raw number mode ----------------------------------------------- #
-        try:
-            toggle = WebDriverWait(driver, 5).until(
-                EC.presence_of_element_located((By.ID, "toggle-data-view"))
-            )
-            if toggle.get_attribute("aria-checked") == "true":   # “%” mode
-                driver.execute_script("arguments[0].click();", toggle)
-                WebDriverWait(driver, 10).until(
-                    lambda d: d.find_element(By.ID, "toggle-data-view")
-                              .get_attribute("aria-checked") == "false"
-                )
-                time.sleep(delay_cfg["data_load"])
-        except Exception as e:
-            print(f"[warn] raw-number toggle unavailable: {e}")
-
-        # --- Helper to flatten a table into out_rows ------------------------------------ #
-        def _flush_table(table: list[dict], label_suffix: str):
-            if not table:
-                return
-            year_col  = next(iter(table[0]))            # first column is Year/KEY
-            recent    = sorted(
-                {int(r[year_col]) for r in table if r[year_col].isdigit()}
-            )[-years_to_keep:]
-
-            ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            for r in table:
-                yr = r[year_col]
-                if yr.isdigit() and int(yr) not in recent:
-                    continue
-                for metric, val in r.items():
-                    if metric == year_col:
-                        continue
-                    figure = f"{metric} {label_suffix}"
-                    row = {
-                        "range": yr,
-                        "figure": figure,
-                        "value": val,
-                        "url": url,
-                        "collection_time": ts,
-                    }
-                    row["id"] = make_id(row["range"], row["figure"], "explore", row["url"])
-                    out_rows.append(row)
-
-        # --- 4. Normal publications view ------------------------------------------------ #
-        try:
-            tbl = extract_table_data(driver)
-        except (StaleElementReferenceException, NoSuchElementException, TimeoutException):
-            print("[info] explore table missing/empty; skipping this URL")
-            tbl = []
-        _flush_table(tbl, "(Explore)")
-
-        # --- 5. Optional: Preprints view ------------------------------------------------ #
-        try:
-            radio_pp = driver.find_element(By.ID, "filter_is_preprint")
-            driver.execute_script("arguments[0].click();", radio_pp)
-            time.sleep(delay_cfg["data_load"])
-            tbl_pp = extract_table_data(driver)
-            _flush_table(tbl_pp, "(Explore – Preprints)")
-        except Exception:
-            # radio absent → silently ignore
-            pass
-
-    driver.quit()
-    return pd.DataFrame(
-        out_rows,
-        columns=["range", "figure", "value", "url", "collection_time", "id"]
+    # Concatenate the per-URL columns, build the frame in one go, then add row IDs
+    df = pd.DataFrame(
+        {c: [v for cols in per_url for v in cols[c]] for c in COLUMNS[:-1]},
+        columns=COLUMNS[:-1],
     )
+    df["id"] = make_ids(df["range"], df["figure"], "explore", df["url"])
+    return df
 
 # --------------------------------------------------------------------------- #
 #  CLI entry point
@@ -205,36 +212,48 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--env", choices=["staging", "dev"], required=True,
                         help="Specify environment: staging, dev")
+    parser.add_argument("--local", "--csv", dest="local", action=argparse.BooleanOptionalAction, default=True,
+                        help="Also write the gzipped daily file under snapshots/ (default: on; "
+                             "--csv/--no-csv are deprecated aliases)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv",
+                        help="Format of the daily file (default: csv)")
+    parser.add_argument("--page-cache", action=argparse.BooleanOptionalAction, default=True,
+                        help="Reuse pages already scraped today from .cache/ (default: on). "
+                             "A same-day rerun then re-uploads those cached rows over today's "
+                             "Drive sheet; use --no-page-cache to scrape every page again")
     args = parser.parse_args()
 
-    df = scrape_explore(args.env)
+    df = scrape_explore(args.env, page_cache=args.page_cache)
     # Keep only the expected columns and handle empty safely
     if df.empty:
         print(f"[info] Explore: no rows for env={args.env}. Skipping CSV and Google Sheets upload.")
         return
 
-    df = df[["range", "figure", "value", "url", "collection_time", "id"]]
+    df = df[COLUMNS]
 
     creds_file = CONFIG["google_sheets"]["creds_file"]
     folder_id = CONFIG["google_sheets"]["folder_id"]
 
-    ENV_TAG_MAP = {"staging": "api", "dev": "beta"}
     env_tag = ENV_TAG_MAP[args.env]
 
-    from extractors.utils import write_daily_csv
-    from export.google_sheets import upload_df_to_daily_gsheet_named
+    # Upload on a background thread while the local CSV is written
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        upload = ex.submit(
+            upload_df_to_daily_gsheet_named,
+            df=df,
+            env_tag=env_tag,
+            section="explore",
+            folder_id=folder_id,
+            creds_path=creds_file,
+            tz="Europe/London",
+        )
 
-    write_daily_csv(df=df, env_tag=env_tag, section="explore",
-                    out_dir="snapshots", tz="Europe/London")
+        if args.local:
+            write_daily = write_daily_jsonl if args.format == "jsonl" else write_daily_csv
+            write_daily(df=df, env_tag=env_tag, section="explore",
+                        out_dir="snapshots", tz="Europe/London")
 
-    upload_df_to_daily_gsheet_named(
-        df=df,
-        env_tag=env_tag,
-        section="explore",
-        folder_id=folder_id,
-        creds_path=creds_file,
-        tz="Europe/London",
-    )
+        upload.result()  # re-raise any upload error
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
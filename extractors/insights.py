@@ -3,135 +3,167 @@
 
 import sys
 import os
-import yaml
 import argparse
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 import pandas as pd
-import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # Ensure parent directory is on sys.path for local package imports
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
 
-from extractors.utils import make_id
+from extractors.utils import load_config
+from extractors.utils import ENV_TAG_MAP
+from extractors.utils import get_driver
+from extractors.utils import JS_CLICK_HELPERS
+from extractors.utils import make_ids
 from extractors.utils import write_daily_csv
+from extractors.utils import write_daily_jsonl
+from extractors.utils import scrape_urls_in_parallel
 from export.google_sheets import upload_df_to_daily_gsheet_named
 
-# Map CLI env to env tag
-ENV_TAG_MAP = {
-    "staging": "api",
-    "dev": "beta"
-}
+# Load configuration from settings.yaml (parsed once, shared across extractors)
+CONFIG = load_config()
 
-# Load configuration from a YAML file
-def load_config():
-    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../config/settings.yaml")
-    print(f"Loading config from: {config_path}")
-    with open(config_path, "r") as file:
-        return yaml.safe_load(file)
+# Every visible insight card as [name, value]: first match of each XPath inside the
+# card, null if absent
+READ_CARDS_JS = """
+const text = (el) => (el ? el.innerText.trim() : null);
+const readCards = (cardsXpath, nameXpath, valueXpath) => nodes(cardsXpath).map(
+  (card) => [text(nodes(nameXpath, card)[0]), text(nodes(valueXpath, card)[0])]
+);
+"""
+
+# Cards plus the page URL, in one WebDriver call. Returns null while no card has
+# rendered yet, so it doubles as the wait condition.
+CARDS_JS = JS_CLICK_HELPERS + READ_CARDS_JS + """
+const [cardsXpath, nameXpath, valueXpath] = arguments;
+const cards = readCards(cardsXpath, nameXpath, valueXpath);
+return cards.length ? {url: location.href, cards} : null;
+"""
+
+# Click the two recent year buttons and all time in turn, wait until the cards have
+# changed from their pre-click values and the DOM is quiet (see JS_CLICK_HELPERS),
+# and read the cards after each click. Runs entirely in the page: one WebDriver call
+# per URL.
+CLICK_AND_READ_JS = JS_CLICK_HELPERS + READ_CARDS_JS + """
+const [yearXpath, allTimeXpath, cardsXpath, nameXpath, valueXpath, quietMs, timeoutMs, presenceMs] = arguments;
+const done = arguments[arguments.length - 1];
+const buttons = nodes(yearXpath).slice(0, 2);
+const allTime = nodes(allTimeXpath)[0];
+if (allTime) buttons.push(allTime);
+clickAndRead(buttons, () => readCards(cardsXpath, nameXpath, valueXpath), quietMs, timeoutMs, presenceMs).then(
+  (ranges) => done({hasAllTime: Boolean(allTime), ranges}),
+  (err) => done({error: String(err)}),
+);
+"""
+
+# Output columns, in order
+COLUMNS = ["range", "figure", "value", "url", "collection_time", "id"]
+
+# XPath for a card's value (the config one plus the known percent_/articles_ spans)
+def _value_xpath(xpaths):
+    return ".//span[contains(@id, 'percent_') or contains(@id, 'articles_')] | " + xpaths["value"]
+
+# Append one date range's [name, value] cards to the per-column lists in cols
+def _append_cards(cols, date_range, page_url, cards, collection_time):
+    n = len(cards)
+    cols["range"].extend([date_range] * n)
+    cols["figure"].extend(name + " (insight)" if name is not None else "N/A" for name, _ in cards)
+    cols["value"].extend(value or "N/A" for _, value in cards)
+    cols["url"].extend([page_url] * n)
+    cols["collection_time"].extend([collection_time] * n)
+
+# Function to extract insights from a page, appended to the per-column lists in cols
+def extract_insights(driver, url, date_range, xpaths, cols):
+    page = WebDriverWait(driver, 10).until(
+        lambda d: d.execute_script(CARDS_JS, xpaths["insights_cards"], xpaths["insight_name"], _value_xpath(xpaths))
+    )
+    collection_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Human-readable timestamp
+    _append_cards(cols, date_range, page["url"], page["cards"], collection_time)
+
+# Scrape the two recent years + all time for a single URL into parallel column lists
+def scrape_insights_url(driver, url, xpaths):
+    cols = {"range": [], "figure": [], "value": [], "url": [], "collection_time": []}
+
+    print(f"Scraping: {url}")
+    driver.get(url)
+    try:
+        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, xpaths["year_buttons"])))
+    except TimeoutException:
+        pass
+
+    year_buttons = driver.find_elements(By.XPATH, xpaths["year_buttons"])
+    if len(year_buttons) < 2:
+        print("No year buttons found, extracting without date_range")
+        extract_insights(driver, url, "", xpaths, cols)
+        return cols
+
+    # Each click waits up to data_load for new cards, then up to 10s more for any
+    # cards at all (the old sleep + presence wait)
+    data_load = CONFIG["delays"]["data_load"]
+    driver.set_script_timeout(3 * (data_load + 10) + 10)
+    result = driver.execute_async_script(
+        CLICK_AND_READ_JS,
+        xpaths["year_buttons"], xpaths["all_time_button"],
+        xpaths["insights_cards"], xpaths["insight_name"], _value_xpath(xpaths),
+        250, data_load * 1000, 10_000,
+    )
+    if "error" in result:
+        raise RuntimeError(f"Insights extraction failed for {url}: {result['error']}")
+    if not result["hasAllTime"]:
+        print("No all-time button found.")
 
-CONFIG = load_config()
+    # Extract insights for each date range
+    collection_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Human-readable timestamp
+    for r in result["ranges"]:
+        _append_cards(cols, r["range"], r["url"], r["rows"], collection_time)
 
-# Initialise WebDriver
-def get_driver():
-    options = webdriver.ChromeOptions()
-    options.add_argument("--headless")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--window-size=1920,1080")
-    driver = webdriver.Chrome(options=options)
-    return driver
-
-# Function to extract insights from a page
-def extract_insights(driver, url, date_range, xpaths):
-    insights_data = []
-    WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, xpaths["insights_cards"])))
-    articles = driver.find_elements(By.XPATH, xpaths["insights_cards"])
-
-    for article in articles:
-        try:
-            insight_name = article.find_element(By.XPATH, xpaths["insight_name"]).text.strip() + " (insight)"
-        except:
-            insight_name = "N/A"
-
-        try:
-            value_element = article.find_element(
-                By.XPATH,
-                ".//span[contains(@id, 'percent_') or contains(@id, 'articles_')] | " + xpaths["value"],
-            )
-            value = value_element.text.strip() if value_element.text.strip() else "N/A"
-        except:
-            value = "N/A"
-
-        collection_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Human-readable timestamp
-        page_url = driver.current_url  # Capture current page URL
-        row = {
-            "range": date_range,
-            "figure": insight_name,
-            "value": value,
-            "url": page_url,
-            "collection_time": collection_time,
-        }
-        row["id"] = make_id(row["range"], row["figure"], "insights", row["url"])
-        insights_data.append(row)
-    return insights_data
-
-# Main function to process all URLs
-def scrape_insights(env):
-    driver = get_driver()
-    all_insights = []
+    return cols
+
+# Main function to process all URLs (one headless Chrome per worker thread)
+def scrape_insights(env, page_cache=True):
     xpaths = CONFIG["xpaths"]
     urls = CONFIG.get("insights_urls", {}).get(env, [])
 
-    for url in urls:
-        print(f"Scraping: {url}")
-        driver.get(url)
-        time.sleep(CONFIG["delays"]["page_load"])
-
-        year_buttons = driver.find_elements(By.XPATH, xpaths["year_buttons"])
-
-        if len(year_buttons) >= 2:
-            # Extract insights for each date range
-            for i, button in enumerate(year_buttons[:2]):
-                button.click()
-                time.sleep(CONFIG["delays"]["data_load"])
-                date_range = button.text.strip()
-                all_insights.extend(extract_insights(driver, url, date_range, xpaths))
-
-            try:
-                all_time_button = driver.find_element(By.XPATH, xpaths["all_time_button"])
-                all_time_button.click()
-                time.sleep(CONFIG["delays"]["data_load"])
-                date_range = all_time_button.text.strip()
-                all_insights.extend(extract_insights(driver, url, date_range, xpaths))
-            except:
-                print("No all-time button found.")
-        else:
-            print("No year buttons found, extracting without date_range")
-            all_insights.extend(extract_insights(driver, url, "", xpaths))
-
-    driver.quit()
-    return all_insights
+    per_url = scrape_urls_in_parallel(
+        urls,
+        lambda driver, url: scrape_insights_url(driver, url, xpaths),
+        make_driver=get_driver,
+        max_workers=CONFIG.get("chrome", {}).get("parallel", 4),
+        cache_section="insights" if page_cache else None,
+    )
+
+    # Concatenate the per-URL columns, build the frame in one go, then add row IDs
+    df = pd.DataFrame(
+        {c: [v for cols in per_url for v in cols[c]] for c in COLUMNS[:-1]},
+        columns=COLUMNS[:-1],
+    )
+    df["id"] = make_ids(df["range"], df["figure"], "insights", df["url"])
+    return df
 
 # Run the scraper and export
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--env", choices=["staging", "dev"], required=True,
                         help="Specify environment: staging, dev")
+    parser.add_argument("--local", "--csv", dest="local", action=argparse.BooleanOptionalAction, default=True,
+                        help="Also write the gzipped daily file under snapshots/ (default: on; "
+                             "--csv/--no-csv are deprecated aliases)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv",
+                        help="Format of the daily file (default: csv)")
+    parser.add_argument("--page-cache", action=argparse.BooleanOptionalAction, default=True,
+                        help="Reuse pages already scraped today from .cache/ (default: on). "
+                             "A same-day rerun then re-uploads those cached rows over today's "
+                             "Drive sheet; use --no-page-cache to scrape every page again")
     args = parser.parse_args()
 
-    insights_data = scrape_insights(args.env)
-
-    # Shape to expected columns up front (avoids KeyError when empty)
-    df = pd.DataFrame(
-        insights_data,
-        columns=["range", "figure", "value", "url", "collection_time", "id"],
-    )
+    df = scrape_insights(args.env, page_cache=args.page_cache)
 
     print(f"Scraped {len(df)} rows total.")
 
@@ -144,24 +176,26 @@ def main():
     creds_file = CONFIG["google_sheets"]["creds_file"]
     folder_id = CONFIG["google_sheets"]["folder_id"]
 
-    # Map CLI env to env tag
-    ENV_TAG_MAP = {"staging": "api", "dev": "beta"}
     env_tag = ENV_TAG_MAP[args.env]
 
-    from extractors.utils import write_daily_csv
-    from export.google_sheets import upload_df_to_daily_gsheet_named
-
-    write_daily_csv(df=df, env_tag=env_tag, section="insights",
-                    out_dir="snapshots", tz="Europe/London")
-
-    upload_df_to_daily_gsheet_named(
-        df=df,
-        env_tag=env_tag,
-        section="insights",
-        folder_id=folder_id,
-        creds_path=creds_file,
-        tz="Europe/London",
-    )
+    # Upload on a background thread while the local CSV is written
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        upload = ex.submit(
+            upload_df_to_daily_gsheet_named,
+            df=df,
+            env_tag=env_tag,
+            section="insights",
+            folder_id=folder_id,
+            creds_path=creds_file,
+            tz="Europe/London",
+        )
+
+        if args.local:
+            write_daily = write_daily_jsonl if args.format == "jsonl" else write_daily_csv
+            write_daily(df=df, env_tag=env_tag, section="insights",
+                        out_dir="snapshots", tz="Europe/London")
+
+        upload.result()  # re-raise any upload error
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,17 +1,50 @@
 from pathlib import Path
 from datetime import datetime
-import pytz
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import count
+import gzip as gzip_lib
+import hashlib
+import os
+import threading
 import re
+import orjson
+import yaml
+from selenium import webdriver
+
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as _YamlLoader
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config", "settings.yaml")
+@lru_cache(maxsize=1)
+def load_config():
+    """Parse config/settings.yaml once per process (treat the result as read-only)."""
+    print(f"Loading config from: {CONFIG_PATH}")
+    with open(CONFIG_PATH, "r") as file:
+        return yaml.load(file, Loader=_YamlLoader)
+
+# Map CLI env to env tag (used in daily sheet/CSV names)
+ENV_TAG_MAP = {
+    "staging": "api",
+    "dev": "beta"
+}
+
 ORG_RE = re.compile(r"https?://(?:(?:dev|staging)\.)?oa\.report/([^/?#]+)", re.I)
+FIG_SUFFIX_RE = re.compile(r"\s*\([^)]*\)\s*$")  # trailing "(insight)", "(Explore …)", …
+
+_DASH_TRANS = str.maketrans({"—": "-", "–": "-"})
+_SLUG_DROP = re.compile(r"[^a-z0-9\- ]+")  # keep letters, digits, space, dash
+_SLUG_SEP = re.compile(r"[ -]+")           # runs of spaces/dashes become one dash
 
+@lru_cache(maxsize=4096)
 def _slugify(s: str) -> str:
-    s = (s or "").strip().lower()
-    s = s.replace("—", "-").replace("–", "-")
-    s = re.sub(r"[^a-z0-9\- ]+", "", s)      # keep letters, digits, space, dash
-    s = re.sub(r"\s+", "-", s)               # spaces become dashes
-    s = re.sub(r"-{2,}", "-", s).strip("-")  # collapse and trim dashes
-    return s
+    s = (s or "").strip().lower().translate(_DASH_TRANS)
+    return _SLUG_SEP.sub("-", _SLUG_DROP.sub("", s)).strip("-")
 
+@lru_cache(maxsize=4096)
 def _section_key(section: str, figure: str) -> str:
     """
     Derive a clean section label from the figure’s trailing parentheses if present.
@@ -33,6 +66,13 @@ def _section_key(section: str, figure: str) -> str:
     return (section or "").strip().lower()
 
 
+@lru_cache(maxsize=256)
+def _org_from_url(url: str) -> str:
+    """Lowercased org slug from an oa.report URL ('' if it isn't one)."""
+    m = ORG_RE.search(url or "")
+    return m.group(1).lower() if m else ""
+
+@lru_cache(maxsize=4096)
 def make_id(date_range: str, figure: str, section: str, url: str) -> str:
     """
     Build a row ID in the form: {range}_{figure-slug}_{section-key}_{org-slug}.
@@ -44,23 +84,232 @@ def make_id(date_range: str, figure: str, section: str, url: str) -> str:
 
     Underscores separate parts; hyphens within slugs.
     """
-    base_fig = re.sub(r"\s*\([^)]*\)\s*$", "", figure or "").strip()  # strip trailing (... )
-    org = (ORG_RE.search(url or "") or [None, ""])[1].lower()
+    base_fig = FIG_SUFFIX_RE.sub("", figure or "").strip()  # strip trailing (... )
+    org = _org_from_url(url)
     return f"{_slugify(date_range)}_{_slugify(base_fig)}_{_section_key(section, figure)}_{org}"
 
+def make_ids(ranges, figures, section: str, urls):
+    """
+    make_id over aligned pandas Series of ranges/figures/urls, column-wise.
+    Figure suffixes and orgs go through pandas string ops; slugs come from the
+    cached helpers, so each distinct value is slugified once.
+    """
+    figures = figures.fillna("").astype(str)  # astype: empty columns come in as float
+    base_fig = figures.str.replace(FIG_SUFFIX_RE, "", regex=True).str.strip()
+    org = urls.fillna("").astype(str).str.extract(ORG_RE, expand=False).fillna("").str.lower()
+    return (
+        ranges.fillna("").astype(str).map(_slugify)
+        + "_" + base_fig.map(_slugify)
+        + "_" + figures.map(lambda f: _section_key(section, f))
+        + "_" + org
+    )
+
 def _today_str(tz_name="Europe/London"):
-    tz = pytz.timezone(tz_name)
-    return datetime.now(tz).strftime("%Y-%m-%d")
+    # ZoneInfo caches instances per key, so repeat calls don't reload the tz file
+    return datetime.now(ZoneInfo(tz_name)).strftime("%Y-%m-%d")
 
-def write_daily_csv(df, env_tag: str, section: str, out_dir: str = "snapshots", tz: str = "Europe/London"):
+def write_daily_csv(df, env_tag: str, section: str, out_dir: str = "snapshots", tz: str = "Europe/London",
+                    gzip: bool = True, chunksize: int = 50_000):
     """
-    Writes a CSV named: {env_tag}_{section}_parsed_data__{yyyy-mm-dd}.csv
-    Columns are preserved exactly as in df.
+    Writes a CSV named: {env_tag}_{section}_parsed_data__{yyyy-mm-dd}.csv(.gz)
+    Columns are preserved exactly as in df. Rows are formatted chunksize at a time
+    and, with gzip=True (default), compressed on the way to disk.
     """
     Path(out_dir).mkdir(parents=True, exist_ok=True)
     date_str = _today_str(tz)
-    fname = f"{env_tag}_{section}_parsed_data__{date_str}.csv"
+    fname = f"{env_tag}_{section}_parsed_data__{date_str}.csv" + (".gz" if gzip else "")
     fpath = Path(out_dir) / fname
-    df.to_csv(fpath, index=False)
+    df.to_csv(fpath, index=False, compression="gzip" if gzip else None, chunksize=chunksize)
     print(f"Wrote daily CSV: {fpath} ({len(df)} rows)")
     return str(fpath)
+
+def write_daily_jsonl(df, env_tag: str, section: str, out_dir: str = "snapshots", tz: str = "Europe/London",
+                      gzip: bool = True):
+    """
+    Writes JSON Lines named: {env_tag}_{section}_parsed_data__{yyyy-mm-dd}.jsonl(.gz)
+    One object per row, keys in df's column order (missing values => null).
+    """
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    date_str = _today_str(tz)
+    fname = f"{env_tag}_{section}_parsed_data__{date_str}.jsonl" + (".gz" if gzip else "")
+    fpath = Path(out_dir) / fname
+    records = df.astype(object).where(df.notna(), None).to_dict("records")
+    with (gzip_lib.open(fpath, "wb") if gzip else open(fpath, "wb")) as f:
+        f.writelines(orjson.dumps(r) + b"\n" for r in records)
+    print(f"Wrote daily JSONL: {fpath} ({len(df)} rows)")
+    return str(fpath)
+
+# JS prelude shared by the in-page (execute_async_script) scrapers:
+#   nodes(xpath, ctx)  -> matching elements, in document order
+#   waitForRead(read, before, quietMs, timeoutMs, presenceMs) -> resolves with read()
+#     once it is non-empty, differs from the pre-click read (before, as JSON) and the
+#     DOM has then been quiet for quietMs. After timeoutMs an unchanged non-empty read
+#     is accepted too (clicking the already-selected range changes nothing); after a
+#     further presenceMs it resolves with whatever read() returns.
+#   clickAndRead(buttons, read, quietMs, timeoutMs, presenceMs) -> click each button
+#     in turn, wait as above, then collect {range: button text, url, rows}
+JS_CLICK_HELPERS = """
+const nodes = (xp, ctx = document) => {
+  const snap = document.evaluate(xp, ctx, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+  return Array.from({length: snap.snapshotLength}, (_, i) => snap.snapshotItem(i));
+};
+const waitForRead = (read, before, quietMs, timeoutMs, presenceMs = 0) => new Promise((resolve) => {
+  let quiet = null, capped = false;
+  const ready = () => {
+    const rows = read();
+    return rows.length && (capped || JSON.stringify(rows) !== before) ? rows : null;
+  };
+  const finish = (rows) => {
+    observer.disconnect(); clearTimeout(quiet); clearTimeout(cap); clearTimeout(giveUp); resolve(rows);
+  };
+  const check = () => {
+    clearTimeout(quiet);
+    if (ready()) quiet = setTimeout(() => { const rows = ready(); if (rows) finish(rows); }, quietMs);
+  };
+  const observer = new MutationObserver(check);
+  observer.observe(document.body, {subtree: true, childList: true, characterData: true});
+  const cap = setTimeout(() => { capped = true; check(); }, timeoutMs);
+  const giveUp = setTimeout(() => finish(read()), timeoutMs + presenceMs);
+});
+const clickAndRead = async (buttons, read, quietMs, timeoutMs, presenceMs = 0) => {
+  const out = [];
+  for (const button of buttons) {
+    const before = JSON.stringify(read());
+    button.click();
+    const rows = await waitForRead(read, before, quietMs, timeoutMs, presenceMs);
+    out.push({range: button.innerText.trim(), url: location.href, rows});
+  }
+  return out;
+};
+"""
+
+# Requests Chrome never sends (Network.setBlockedURLs wildcards): trackers and web
+# font files, none of which the scrapers read. Extend via chrome.blocked_urls.
+BLOCKED_URL_PATTERNS = (
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*doubleclick.net*",
+    "*plausible.io*",
+    "*hotjar.com*",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+)
+
+# Open lock files of the profile slots this process holds (released on exit)
+_profile_locks = []
+
+def _claim_profile_dir(profile_dir):
+    """
+    First free worker-N profile under profile_dir, as an exclusive flock on
+    worker-N.lock (held for the life of the process). Concurrent extractors on one
+    machine each skip to the next free slot, so no two Chromes share a profile.
+    """
+    import fcntl  # POSIX only; profile_dir is opt-in
+
+    root = Path(profile_dir).expanduser()
+    root.mkdir(parents=True, exist_ok=True)
+    for slot in count():
+        lock_file = open(root / f"worker-{slot}.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            continue
+        _profile_locks.append(lock_file)
+        return root / f"worker-{slot}"
+
+def get_driver(page_load_strategy: str = "normal"):
+    """
+    Headless Chrome for the scrapers. Only DOM text is read, so images, web
+    fonts and analytics scripts are never downloaded.
+
+    If chrome.profile_dir is set, each driver gets its own persistent profile
+    under it (Chrome can't share one between concurrent browsers), so the HTTP
+    cache and compiled JS carry over between runs.
+    """
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--window-size=1920,1080")
+    options.add_argument("--disable-extensions")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-background-networking")
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,
+        "profile.managed_default_content_settings.fonts": 2,
+    })
+
+    profile_dir = load_config().get("chrome", {}).get("profile_dir")
+    if profile_dir:
+        worker_dir = _claim_profile_dir(profile_dir)
+        worker_dir.mkdir(exist_ok=True)
+        # We hold the slot's lock, so any Singleton* files are left over from a
+        # crashed run and would make Chrome refuse the profile
+        for lock in worker_dir.glob("Singleton*"):
+            lock.unlink(missing_ok=True)
+        options.add_argument(f"--user-data-dir={worker_dir}")
+
+    options.page_load_strategy = page_load_strategy
+    driver = webdriver.Chrome(options=options)
+
+    blocked = [*BLOCKED_URL_PATTERNS, *load_config().get("chrome", {}).get("blocked_urls", [])]
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked})
+    return driver
+
+# Per-day cache of scraped pages (see scrape_urls_in_parallel)
+PAGE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache")
+
+def _page_cache_paths(section, tz="Europe/London"):
+    """
+    Path builder for today's cache entries of a section: {section}_{yyyy-mm-dd}_{sha1(url)}.json.
+    Entries from earlier days are removed, so the cache never outlives the day.
+    """
+    cache_dir = Path(PAGE_CACHE_DIR)
+    prefix = f"{section}_{_today_str(tz)}_"
+    for old in cache_dir.glob(f"{section}_*.json"):
+        if not old.name.startswith(prefix):
+            old.unlink(missing_ok=True)
+    return lambda url: cache_dir / f"{prefix}{hashlib.sha1(url.encode()).hexdigest()}.json"
+
+def scrape_urls_in_parallel(urls, scrape_one, make_driver, max_workers=4, cache_section=None):
+    """
+    Run scrape_one(driver, url) for every URL on a thread pool.
+    Each worker thread lazily creates one driver via make_driver() and reuses it
+    for all URLs it picks up. Results come back in URL order; all drivers are
+    quit once the pool is done (or on error).
+
+    With cache_section set, each URL's result (a dict of column lists) is saved to
+    PAGE_CACHE_DIR for the rest of the day, and a same-day rerun reads it back
+    instead of opening the page. Empty results are not cached, so they are retried.
+    """
+    local = threading.local()
+    drivers = []
+    cache_path = _page_cache_paths(cache_section) if cache_section else None
+
+    def _run(url):
+        path = cache_path(url) if cache_path else None
+        if path is not None and path.exists():
+            print(f"[cache] {url}")
+            return orjson.loads(path.read_bytes())
+
+        driver = getattr(local, "driver", None)
+        if driver is None:
+            driver = local.driver = make_driver()
+            drivers.append(driver)
+        result = scrape_one(driver, url)
+
+        if path is not None and any(map(len, result.values())):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+            tmp.write_bytes(orjson.dumps(result))
+            os.replace(tmp, path)  # atomic: a killed run never leaves half a file
+        return result
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as ex:
+            return list(ex.map(_run, urls))
+    finally:
+        for driver in drivers:
+            driver.quit()